@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+"""
+Play many headless games at once across a pool of processes
+Each game gets its own seed and a policy choosing its controls. One line of
+JSON is printed per game as soon as it finishes.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+# SDL otherwise catches SIGTERM, so the pool can't stop its workers
+os.environ.setdefault("SDL_NO_SIGNAL_HANDLERS", "1")
+
+import sqasteroids as sq
+
+
+def idle_policy(game, state, rng):
+    return 0
+
+
+def spin_and_fire_policy(game, state, rng):
+    return sq.ROTATE_LEFT | sq.FIRE
+
+
+def random_policy(game, state, rng):
+    """Random controls - except START, which is only pressed to begin"""
+    return rng.randrange(sq.START)
+
+
+def aim_policy(game, state, rng):
+    """Turn towards the nearest square and fire, with a little thrust now and then"""
+    squares = state["squares"]
+    if not squares:
+        return 0
+    x, y, _, _, orientation = state["player"]
+    target_x, target_y = min(squares, key=lambda s: (s[0] - x) ** 2 + (s[1] - y) ** 2)[:2]
+    sines, cosines = game.player.atlas.sin, game.player.atlas.cos
+    # Ship points along (-sin, -cos) of its orientation - cross product says which way to turn
+    cross = -sines[orientation] * (target_y - y) + cosines[orientation] * (target_x - x)
+    inputs = sq.FIRE | (sq.ROTATE_LEFT if cross < 0 else sq.ROTATE_RIGHT)
+    if rng.random() < 0.05:
+        inputs |= sq.THRUST
+    return inputs
+
+
+POLICIES = {
+    "idle": idle_policy,
+    "spin_and_fire": spin_and_fire_policy,
+    "random": random_policy,
+    "aim": aim_policy,
+}
+
+
+def play(task):
+    """Play one game to the end or max_ticks
+    Args:
+        task - (seed, policy name, max_ticks, rotation_steps)
+    Returns:
+        dict of results
+    """
+    seed, policy_name, max_ticks, rotation_steps = task
+    policy = POLICIES[policy_name]
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    game = sq.Game(headless=True, seed=seed, rotation_steps=rotation_steps)
+    state = game.step(sq.START)
+    while state["ticks"] < max_ticks and state["game_in_progress"]:
+        state = game.step(policy(game, state, rng))
+    game.shutdown()
+    return {"seed": seed,
+            "policy": policy_name,
+            "score": state["score"],
+            "level": state["level"],
+            "ticks": state["ticks"],
+            "seconds": time.perf_counter() - start}
+
+
+def run_batch(seeds, policy="random", max_ticks=3600, processes=None,
+              rotation_steps=sq.ROTATION_STEPS):
+    """Play a game for each seed in parallel
+    Yields:
+        result dicts (see play) in the order the games finish
+    """
+    tasks = [(seed, policy, max_ticks, rotation_steps) for seed in seeds]
+    with multiprocessing.Pool(processes) as pool:
+        yield from pool.imap_unordered(play, tasks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--policy", choices=list(POLICIES), default="random")
+    parser.add_argument("--max-ticks", type=int, default=3600,
+                        help="stop each game after this many ticks")
+    parser.add_argument("--processes", type=int, help="default one per CPU")
+    parser.add_argument("--rotation-steps", type=int, default=sq.ROTATION_STEPS,
+                        help="number of orientations the ship can face")
+    args = parser.parse_args()
+
+    seeds = range(args.first_seed, args.first_seed + args.games)
+    start = time.perf_counter()
+    ticks = 0
+    for result in run_batch(seeds, args.policy, args.max_ticks, args.processes,
+                            args.rotation_steps):
+        ticks += result["ticks"]
+        print(json.dumps(result), flush=True)
+    elapsed = time.perf_counter() - start
+    print(f"{args.games} games, {ticks} ticks in {elapsed:.1f}s "
+          f"({ticks / elapsed:.0f} ticks/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the game loop with scripted scenarios
+Runs without a visible window (SDL dummy video driver) and prints JSON
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+# Keep stdout to just the JSON
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+import pygame
+import sqasteroids as sq
+
+
+def welcome_setup(game):
+    """Welcome screen with its marching squares - nothing to do"""
+
+
+def level_1_setup(game):
+    game.step(sq.START)
+
+
+def level_20_setup(game):
+    """Level 20 plus a crowd of already split squares"""
+    game.step(sq.START)
+    for sprite in game.square_sprites.sprites():
+        sprite.kill()
+    game.level = 20
+    game.level_setup()
+    for life in (2, 1):
+        xs = game.rng.integers(0, sq.WIDTH, 30).tolist()
+        ys = game.rng.integers(0, sq.HEIGHT, 30).tolist()
+        game.make_sqasteroids(xs, ys, life)
+
+
+def idle_policy(game, frame):
+    return 0
+
+
+def spin_and_fire_policy(game, frame):
+    return sq.ROTATE_LEFT | sq.FIRE | (sq.THRUST if frame % 30 < 5 else 0)
+
+
+def sustained_fire_policy(game, frame):
+    """Fire every tick and keep plenty of targets about for continuous explosions"""
+    game.reload_counter = 0
+    if len(game.square_sprites) < 20:
+        xs = game.rng.integers(0, sq.WIDTH, 10).tolist()
+        ys = game.rng.integers(0, sq.HEIGHT, 10).tolist()
+        game.make_sqasteroids(xs, ys, 1)
+    return sq.ROTATE_LEFT | sq.FIRE
+
+
+# name: (setup, policy)
+SCENARIOS = {
+    "welcome": (welcome_setup, idle_policy),
+    "level_1": (level_1_setup, spin_and_fire_policy),
+    "level_20": (level_20_setup, spin_and_fire_policy),
+    "sustained_fire": (level_1_setup, sustained_fire_policy),
+}
+
+
+def percentiles(times):
+    """Summary of a list of durations in seconds, in milliseconds"""
+    times = np.array(times) * 1000
+    return {"mean": float(times.mean()),
+            "p50": float(np.percentile(times, 50)),
+            "p95": float(np.percentile(times, 95)),
+            "p99": float(np.percentile(times, 99))}
+
+
+def run_scenario(name, frames=600, seed=1, render=True, bullet_pool_size=sq.BULLET_POOL_SIZE):
+    """Run one scenario and measure every frame
+    Returns:
+        dict of results
+    """
+    setup, policy = SCENARIOS[name]
+    screen = pygame.display.set_mode((sq.WIDTH, sq.HEIGHT)) if render else None
+    game = sq.Game(headless=True, seed=seed, screen=screen, bullet_pool_size=bullet_pool_size)
+    # Keep the ship (and its shooting) going for the whole run
+    game.invulnerable = True
+    setup(game)
+
+    sim_times = []
+    render_times = []
+    sprites = 0
+    blocks = 0
+    game_over_frame = None
+    collections = []
+
+    def count_collection(phase, info):
+        if phase == "start":
+            collections.append(info["generation"])
+
+    gc.callbacks.append(count_collection)
+    try:
+        for frame in range(frames):
+            inputs = policy(game, frame)
+            blocks_before = sys.getallocatedblocks()
+            start = time.perf_counter()
+            in_progress = game.game_in_progress
+            game.step(inputs)
+            sim_end = time.perf_counter()
+            if in_progress and not game.game_in_progress and game_over_frame is None:
+                game_over_frame = frame
+            if render:
+                game.render()
+            render_end = time.perf_counter()
+            blocks += sys.getallocatedblocks() - blocks_before
+            sim_times.append(sim_end - start)
+            render_times.append(render_end - sim_end)
+            sprites += len(game.all_sprites) + len(game.particles)
+    finally:
+        gc.callbacks.remove(count_collection)
+
+    total = sum(sim_times) + sum(render_times)
+    result = {"frames": frames,
+              "sim_ms": percentiles(sim_times),
+              "sprites_per_second": sprites / total,
+              # Net growth in allocated memory blocks - a leak/churn indicator
+              "alloc_blocks_per_frame": blocks / frames,
+              "gc_collections": len(collections),
+              "final_sprites": len(game.all_sprites),
+              "final_particles": len(game.particles),
+              # Shots and fragments that didn't fit in the bullet pool or particle limit
+              "bullets_dropped": game.bullet_pool.dropped,
+              "particles_dropped": game.particles.dropped,
+              "final_level": game.level,
+              "game_in_progress": game.game_in_progress,
+              # Frame the ship was destroyed on, if it was
+              "game_over_frame": game_over_frame}
+    if render:
+        result["render_ms"] = percentiles(render_times)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("scenarios", nargs="*", metavar="SCENARIO",
+                        help=f"scenarios to run, default all of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-render", action="store_true", help="time the simulation only")
+    parser.add_argument("--bullet-pool", type=int, default=sq.BULLET_POOL_SIZE,
+                        help="most bullets alive at once")
+    parser.add_argument("--output", metavar="FILE", help="write the JSON here as well")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario: {', '.join(sorted(unknown))}")
+
+    report = {"python": platform.python_version(),
+              "pygame": pygame.version.ver,
+              "numpy": np.__version__,
+              "video_driver": pygame.display.get_driver(),
+              "scenarios": {}}
+    for name in args.scenarios or SCENARIOS:
+        report["scenarios"][name] = run_scenario(name, args.frames, args.seed, not args.no_render,
+                                                 args.bullet_pool)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text)
+
+
+if __name__ == "__main__":
+    main()
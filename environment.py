@@ -0,0 +1,150 @@
+"""
+Reset/step environment wrapper round the game for training agents
+Follows the shape of the Gym API without depending on it.
+
+Actions are integers 0-15, the OR of ROTATE_LEFT, ROTATE_RIGHT, THRUST and FIRE
+(START is pressed by reset). Observations are either the entity state as a flat
+float32 vector or a downsampled RGB frame.
+"""
+
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+import pygame
+import sqasteroids as sq
+
+N_ACTIONS = sq.START
+PLAYER_FEATURES = 6
+SQUARE_FEATURES = 5
+
+
+class SqasteroidsEnv:
+    def __init__(self, observation="state", max_squares=32, frame_size=(160, 100),
+                 max_ticks=3600, tick_rate=sq.TICK_RATE, seed=None):
+        """
+        Args:
+            observation - "state" for entity positions or "pixels" for a downsampled frame
+            max_squares - number of squares included in a state observation, nearest first
+            frame_size - (width, height) of pixel observations
+            max_ticks - episode length limit
+            tick_rate - passed on to Game
+            seed - seeds the sequence of games played
+        """
+        if observation not in ("state", "pixels"):
+            raise ValueError(f"Unknown observation type {observation!r}")
+        self.observation = observation
+        self.max_squares = max_squares
+        self.frame_size = frame_size
+        self.max_ticks = max_ticks
+        self.tick_rate = tick_rate
+        self.n_actions = N_ACTIONS
+        if observation == "state":
+            self.observation_shape = (PLAYER_FEATURES + SQUARE_FEATURES * max_squares,)
+            self.screen = None
+        else:
+            self.observation_shape = (frame_size[1], frame_size[0], 3)
+            self.screen = pygame.Surface((sq.WIDTH, sq.HEIGHT))
+            self.frame = pygame.Surface(frame_size)
+        self.seeds = np.random.SeedSequence(seed)
+        self.game = None
+        self.state = None
+
+    def reset(self, seed=None):
+        """Start a new game
+        Returns:
+            the first observation
+        """
+        if seed is None:
+            seed = int(self.seeds.spawn(1)[0].generate_state(1, np.uint64)[0])
+        if self.game is not None:
+            self.game.shutdown()
+        self.game = sq.Game(headless=True, tick_rate=self.tick_rate, seed=seed, screen=self.screen)
+        self.state = self.game.step(sq.START)
+        return self.observe()
+
+    def step(self, action):
+        """Play one tick with the given controls
+        Returns:
+            (observation, reward, done, info) - reward is the score gained,
+            info is the game state dict
+        """
+        score = self.state["score"]
+        self.state = self.game.step(int(action))
+        reward = self.state["score"] - score
+        done = self.state["ticks"] >= self.max_ticks or not self.state["game_in_progress"]
+        return self.observe(), reward, done, self.state
+
+    def observe(self):
+        if self.observation == "pixels":
+            return self.pixels()
+        return self.entities()
+
+    def entities(self):
+        """Player then nearest squares, positions scaled to about -1 to 1, zero padded"""
+        observation = np.zeros(self.observation_shape, dtype=np.float32)
+        x, y, dx, dy, orientation = self.state["player"]
+        sines, cosines = self.game.player.atlas.sin, self.game.player.atlas.cos
+        observation[:PLAYER_FEATURES] = (x / sq.WIDTH, y / sq.HEIGHT, dx / 10, dy / 10,
+                                         sines[orientation], cosines[orientation])
+        squares = np.array(self.state["squares"], dtype=np.float32).reshape(-1, SQUARE_FEATURES)
+        if len(squares):
+            # Relative to the player, nearest first
+            squares[:, 0] = (squares[:, 0] - x) / sq.WIDTH
+            squares[:, 1] = (squares[:, 1] - y) / sq.HEIGHT
+            squares[:, 2:4] /= 4
+            squares[:, 4] /= 3
+            order = np.argsort(squares[:, 0] ** 2 + squares[:, 1] ** 2)[:self.max_squares]
+            observation[PLAYER_FEATURES:PLAYER_FEATURES + SQUARE_FEATURES * len(order)] = \
+                squares[order].ravel()
+        return observation
+
+    def pixels(self):
+        """The current frame scaled down to frame_size, as a (height, width, 3) uint8 array"""
+        self.game.render()
+        pygame.transform.scale(self.screen, self.frame_size, self.frame)
+        return pygame.surfarray.array3d(self.frame).transpose(1, 0, 2)
+
+
+class VectorEnv:
+    """Several environments stepped together, with batched NumPy observations
+    An environment that finishes is reset straight away - its final info is still returned.
+    """
+    def __init__(self, count, seed=None, **kwargs):
+        """
+        Args:
+            count - number of environments
+            seed - seeds all the environments
+            kwargs - passed to each SqasteroidsEnv
+        """
+        seeds = np.random.SeedSequence(seed).spawn(count)
+        self.envs = [SqasteroidsEnv(seed=int(env_seed.generate_state(1, np.uint64)[0]), **kwargs)
+                     for env_seed in seeds]
+        self.n_actions = N_ACTIONS
+        self.observation_shape = (count,) + self.envs[0].observation_shape
+
+    def reset(self):
+        return np.stack([env.reset() for env in self.envs])
+
+    def step(self, actions):
+        """
+        Args:
+            actions - one action per environment
+        Returns:
+            (observations, rewards, dones, infos) - arrays with one row per environment
+            and a list of infos
+        """
+        observations = np.empty(self.observation_shape, dtype=np.float32
+                                if self.envs[0].observation == "state" else np.uint8)
+        rewards = np.empty(len(self.envs), dtype=np.float32)
+        dones = np.empty(len(self.envs), dtype=bool)
+        infos = []
+        for index, (env, action) in enumerate(zip(self.envs, actions)):
+            observation, rewards[index], dones[index], info = env.step(action)
+            if dones[index]:
+                observation = env.reset()
+            observations[index] = observation
+            infos.append(info)
+        return observations, rewards, dones, infos
@@ -7,11 +7,16 @@ Asteroids style game
 # To do -
 
 #  Hi score
-#  Collisions with ship
 # Abolish game_in_progress and use level > 0 instead
 
+import functools
+import hashlib
 import math
-import random
+import os
+import struct
+import time
+from collections import deque
+import numpy as np
 import pygame
 pygame.init()
 
@@ -24,31 +29,292 @@ YSCALE = HEIGHT/25
 XCHUNKS = list(range(0, WIDTH, int(XSCALE)))
 YCHUNKS = list(range(0, HEIGHT, int(YSCALE)))
 
+# Fixed simulation rate - independent of how often the screen is redrawn
+TICK_RATE = 60
+# Speeds, lives and timers are given per tick at this rate and scaled to the actual tick rate
+BASE_TICK_RATE = 60
+# Limit on catch-up ticks per rendered frame so a long stall can't snowball
+MAX_TICKS_PER_FRAME = 5
 
-class RectSprite(pygame.sprite.Sprite):
+# Number of orientations the player ship can face
+ROTATION_STEPS = 36
+
+# Sprites available for recycling - more than this are never alive at once
+BULLET_POOL_SIZE = 16
+# Most particles alive at once - any more are dropped
+PARTICLE_LIMIT = 4096
+
+# Arrays of motion state kept by EntityStore and ParticleSystem, in step_motion's argument order
+MOTION_ARRAYS = (("x", float), ("y", float), ("prev_x", float), ("prev_y", float),
+                 ("dx", float), ("dy", float), ("life", float), ("dlife", float),
+                 ("bounce", bool))
+
+# Player control bits - one tick's worth of input is the OR of these
+ROTATE_LEFT = 1
+ROTATE_RIGHT = 2
+THRUST = 4
+FIRE = 8
+START = 16
+CONTROL_KEYS = ((pygame.K_a, ROTATE_LEFT),
+                (pygame.K_d, ROTATE_RIGHT),
+                (pygame.K_RSHIFT, THRUST),
+                (pygame.K_RETURN, FIRE),
+                (pygame.K_SPACE, START))
+
+
+class EntityStore:
+    """Physics state for many sprites held as parallel NumPy arrays
+    Each entity has a slot - an index into the x, y (centre position),
+    dx, dy, life, dlife and bounce arrays. step() moves, ages and confines all of them
+    in a handful of array operations instead of one sprite at a time.
+    """
+    def __init__(self, capacity=256, width=WIDTH, height=HEIGHT):
+        self.width = width
+        self.height = height
+        self.count = 0 # slots below this have been used at some point
+        self.free = []
+        # Slots of removed entities - not reused until the next step so a sprite
+        # killed this tick can still be read
+        self.released = []
+        self.allocate(capacity)
+
+    def allocate(self, capacity):
+        """Create (or grow) the arrays to hold the given number of entities"""
+        old_count = self.count
+        allocate_arrays(self, MOTION_ARRAYS + (("active", bool),), capacity, old_count)
+        self.owners = getattr(self, "owners", []) + [None] * (capacity - old_count)
+        self.capacity = capacity
+
+    def add(self, owner, x, y, dx=0, dy=0, life=80, dlife=0, bounce=True):
+        """Store a new entity
+        Args:
+            owner - the sprite the entity belongs to
+            x, y - centre position
+            bounce (bool) - rebound from screen edges when true, otherwise wrap round
+        Returns:
+            slot index for the entity
+        """
+        if self.free:
+            slot = self.free.pop()
+        else:
+            if self.count == self.capacity:
+                self.allocate(self.capacity * 2)
+            slot = self.count
+            self.count += 1
+        self.x[slot] = self.prev_x[slot] = x
+        self.y[slot] = self.prev_y[slot] = y
+        self.dx[slot] = dx
+        self.dy[slot] = dy
+        self.life[slot] = life
+        self.dlife[slot] = dlife
+        self.bounce[slot] = bounce
+        self.active[slot] = True
+        self.owners[slot] = owner
+        return slot
+
+    def clear(self):
+        """Remove every entity"""
+        self.active[:] = False
+        self.owners = [None] * self.capacity
+        self.count = 0
+        self.free.clear()
+        self.released.clear()
+
+    def remove(self, owner):
+        """Stop simulating an entity. Does nothing if it's already gone
+        Returns:
+            True if the entity was removed
+        """
+        slot = owner.slot
+        if self.active[slot] and self.owners[slot] is owner:
+            self.active[slot] = False
+            self.released.append(slot)
+            return True
+        return False
+
+    def step(self, dt=1.0):
+        """Advance all entities by one tick
+        Args:
+            dt - length of the tick in base ticks (see BASE_TICK_RATE)
+        Returns:
+            owners of entities whose life has run out (they're still active)
+        """
+        self.free.extend(self.released)
+        self.released.clear()
+        count = self.count
+        step_motion(*(getattr(self, name)[:count] for name, _ in MOTION_ARRAYS),
+                    dt, self.width, self.height)
+        expired = np.flatnonzero(self.active[:count] & (self.life[:count] < 0))
+        return [self.owners[slot] for slot in expired.tolist()]
+
+    def sync_rects(self, alpha=1.0, sprites=None):
+        """Move sprites' rects to their stored positions
+        Positions are only held as floats in the store, rects are just brought
+        up to date when something needs them - drawing or collision tests.
+        Args:
+            alpha - fraction of the way from the position before the last step to
+                    the current one, to draw part way between ticks
+            sprites - sprites to move, default all active ones
+        """
+        if sprites is None:
+            slots = np.flatnonzero(self.active[:self.count])
+        else:
+            slots = np.fromiter((sprite.slot for sprite in sprites), dtype=int, count=len(sprites))
+        x, y = interpolate_positions(self.x[slots], self.y[slots], self.prev_x[slots],
+                                     self.prev_y[slots], alpha, self.width, self.height)
+        owners = self.owners
+        for slot, x, y in zip(slots.tolist(), np.rint(x).astype(int).tolist(),
+                              np.rint(y).astype(int).tolist()):
+            owners[slot].rect.center = (x, y)
+
+
+def prepare_image(image, colorkey=None, alpha=255):
+    """Get a surface ready for fast blitting
+    Once a window is open the surface is converted to the display's pixel format.
+    Images with per-pixel alpha keep it, otherwise the colour key and
+    whole-surface alpha are set with RLE acceleration.
+    Args:
+        image - the surface
+        colorkey - colour to treat as transparent, or None
+        alpha - transparency of the whole image (0-255)
+    Returns:
+        the prepared surface (a converted copy when a window is open)
+    """
+    display_ready = pygame.display.get_surface() is not None
+    if image.get_flags() & pygame.SRCALPHA:
+        return image.convert_alpha() if display_ready else image
+    if display_ready:
+        image = image.convert()
+    if colorkey is not None:
+        image.set_colorkey(colorkey, pygame.RLEACCEL)
+    if alpha < 255:
+        image.set_alpha(alpha, pygame.RLEACCEL)
+    return image
+
+
+@functools.lru_cache(maxsize=256)
+def get_rect_image(width, height, colour=(255, 255, 255), alpha=255):
+    """Shared filled rectangle surface - sprites of the same size and colour all use one image
+    so it must be treated as read-only
+    """
+    image = pygame.Surface([width, height])
+    image.fill(colour)
+    # Only a black rectangle has any pixels for the colour key to remove
+    colorkey = (0, 0, 0) if colour == (0, 0, 0) else None
+    return prepare_image(image, colorkey, alpha)
+
+
+@functools.lru_cache(maxsize=64)
+def get_rect_mask(width, height):
+    """Shared collision mask for a solid rectangle"""
+    return pygame.mask.Mask((width, height), fill=True)
+
+
+def blit_batch(surface, batch, rects=True):
+    """Draw a list of (image, position) pairs with a single call
+    fblits is used when pygame has it and no rects are wanted, otherwise blits
+    Args:
+        rects (bool) - return the rects drawn on, only needed for dirty updates
+    Returns:
+        list of rects drawn on (empty when rects is false)
+    """
+    if rects:
+        return surface.blits(batch)
+    fblits = getattr(surface, "fblits", None)
+    if fblits is not None:
+        fblits(batch)
+    else:
+        surface.blits(batch, False)
+    return []
+
+
+class StoredEntity:
+    """Position, speed and life properties that read and write an EntityStore slot
+    Shared by RectSprite and Entity - needs store, slot and rect attributes.
+    """
+    __slots__ = ()
+
+    @property
+    def x(self):
+        """Centre x coordinate"""
+        return float(self.store.x[self.slot])
+
+    @x.setter
+    def x(self, value):
+        self.store.x[self.slot] = value
+
+    @property
+    def y(self):
+        """Centre y coordinate"""
+        return float(self.store.y[self.slot])
+
+    @y.setter
+    def y(self, value):
+        self.store.y[self.slot] = value
+
+    @property
+    def dx(self):
+        return float(self.store.dx[self.slot])
+
+    @dx.setter
+    def dx(self, value):
+        self.store.dx[self.slot] = value
+
+    @property
+    def dy(self):
+        return float(self.store.dy[self.slot])
+
+    @dy.setter
+    def dy(self, value):
+        self.store.dy[self.slot] = value
+
+    @property
+    def life(self):
+        return float(self.store.life[self.slot])
+
+    @life.setter
+    def life(self, value):
+        self.store.life[self.slot] = value
+
+    @property
+    def dlife(self):
+        return float(self.store.dlife[self.slot])
+
+    @dlife.setter
+    def dlife(self, value):
+        self.store.dlife[self.slot] = value
+
+    def reset(self, x=0, y=0, dx=0, dy=0, life=80, dlife=0, bounce=True):
+        """Bring a killed sprite back to life at a new position, keeping its image"""
+        self.rect.topleft = (x, y)
+        self.slot = self.store.add(self, x + self.rect.width / 2, y + self.rect.height / 2,
+                                   dx, dy, life, dlife, bounce)
+
+class RectSprite(StoredEntity, pygame.sprite.Sprite):
     """Sprite
     Either uses supplied image or creates a rectangle of specified sie
+    Position, speed and life are kept in an EntityStore - the sprite is a view onto its slot.
+    store must be given - only the owner of the store (e.g. Game.entities) moves the sprite.
     """
+    # SpritePool the sprite goes back to when killed
+    pool = None
+
     def __init__(self, x=0, y=0, dx=0, dy=0, image=None, width=64, height=64,
-                 colour=(255, 255, 255), angle=0, alpha=255, life=80, dlife=0):
+                 colour=(255, 255, 255), angle=0, alpha=255, life=80, dlife=0, bounce=True,
+                 *, store):
         super().__init__()
-        self.dx = dx
-        self.dy = dy
-        self.life = life
-        self.dlife = dlife
-
         if image:
-            self.image = image
+            self.image = prepare_image(image, (0, 0, 0), alpha)
         else:
-            self.image = pygame.Surface([width, height])
-            self.image.fill(colour)
-
-        self.image.set_colorkey((0, 0, 0))
-        self.image.set_alpha(alpha)
+            self.image = get_rect_image(int(width), int(height), tuple(colour), alpha)
         self.rect = self.image.get_rect()
         self.rect.topleft = (x, y)
+        # Exact centre - the rect can only hold whole pixels
+        centre = (x + self.rect.width / 2, y + self.rect.height / 2)
         if angle:
             self.rotate(angle)
+        self.store = store
+        self.slot = self.store.add(self, *centre, dx, dy, life, dlife, bounce)
 
     def rotate(self, angle=0):
         """Rotate sprite by given angle
@@ -56,119 +322,711 @@ class RectSprite(pygame.sprite.Sprite):
             angle - rotation angle in degrees (float/int)
         """
         original_centre = self.rect.center
-        self.image = pygame.transform.rotate(self.image, angle)
+        self.image = prepare_image(pygame.transform.rotate(self.image, angle), (0, 0, 0),
+                                   self.image.get_alpha() or 255)
         # Need to reset the rectangle - it's always parallel to screen axes
         # so size will usually change when image is rotated
         self.rect = self.image.get_rect()
         # Ensure new rect has same centre position as the previous one
         self.rect.center = original_centre
 
-    def update(self):
-        self.rect.x += self.dx
-        self.rect.y += self.dy
-        self.life += self.dlife
-        if self.life < 0:
-            self.kill()
-        self.confine()
+    def kill(self):
+        super().kill()
+        if self.store.remove(self) and self.pool is not None:
+            self.pool.release(self)
 
-    def confine(self):
-        """Confine coordinates within the allowed range"""
-        self.rect.centerx, self.dx = confiner(self.rect.centerx, self.dx, minimum=0, maximum=WIDTH)
-        self.rect.centery, self.dy = confiner(self.rect.centery, self.dy, minimum=0, maximum=HEIGHT)
+
+class Entity(StoredEntity):
+    """Lean rectangle for things there are lots of - bullets and squares
+    Has __slots__ rather than an instance dict and keeps track of its own groups,
+    with the add_internal/remove_internal/kill/alive methods pygame's groups expect
+    from a Sprite, so it can go in the same groups as RectSprites.
+    """
+    __slots__ = ("image", "rect", "store", "slot", "pool", "_groups")
+
+    def __init__(self, x=0, y=0, dx=0, dy=0, width=64, height=64, colour=(255, 255, 255),
+                 alpha=255, life=80, dlife=0, bounce=True, *, store):
+        """Arguments as RectSprite, less image and angle"""
+        self.image = get_rect_image(int(width), int(height), tuple(colour), alpha)
+        self.rect = self.image.get_rect(topleft=(x, y))
+        # SpritePool the entity goes back to when killed
+        self.pool = None
+        # Groups the entity is in - never more than a couple, so a tuple
+        # (the empty one is shared) is much smaller than a set
+        self._groups = ()
+        self.store = store
+        self.slot = self.store.add(self, x + self.rect.width / 2, y + self.rect.height / 2,
+                                   dx, dy, life, dlife, bounce)
+
+    def add(self, *groups):
+        for group in groups:
+            if group not in self._groups:
+                group.add_internal(self)
+                self._groups += (group,)
+
+    def remove(self, *groups):
+        for group in groups:
+            if group in self._groups:
+                group.remove_internal(self)
+                self.remove_internal(group)
+
+    @staticmethod
+    def add_new(entities, *groups):
+        """Put a batch of newly made entities in the groups, one bulk insert per group
+        The entities mustn't be in any groups yet, and the groups must be plain
+        pygame Groups - membership is written straight into their spritedict
+        """
+        for group in groups:
+            group.spritedict.update(dict.fromkeys(entities))
+        for entity in entities:
+            entity._groups = groups
+
+    def add_internal(self, group):
+        if group not in self._groups:
+            self._groups += (group,)
+
+    def remove_internal(self, group):
+        self._groups = tuple(member for member in self._groups if member is not group)
+
+    def groups(self):
+        return list(self._groups)
+
+    def alive(self):
+        return bool(self._groups)
+
+    def kill(self):
+        for group in self._groups:
+            group.remove_internal(self)
+        self._groups = ()
+        if self.store.remove(self) and self.pool is not None:
+            self.pool.release(self)
+
+
+class SpritePool:
+    """Fixed number of sprites or Entities that are recycled rather than created and discarded
+    Killed sprites return to the pool automatically. When every sprite is in use
+    acquire returns None - the caller goes without - and dropped is incremented.
+    """
+    def __init__(self, capacity, factory):
+        """
+        Args:
+            capacity (int) - number of sprites, all created up front
+            factory - callable returning a new RectSprite or Entity
+        """
+        self.capacity = capacity
+        self.dropped = 0
+        self.free = []
+        for _ in range(capacity):
+            sprite = factory()
+            sprite.pool = self
+            sprite.kill()
+
+    def acquire(self, x=0, y=0, dx=0, dy=0, life=80, dlife=0, groups=()):
+        """Take a sprite from the pool and reset it (see StoredEntity.reset)
+        Args:
+            groups - sprite groups to add it to
+        Returns:
+            the sprite, or None if the pool is exhausted
+        """
+        if not self.free:
+            self.dropped += 1
+            return None
+        sprite = self.free.pop()
+        sprite.reset(x, y, dx, dy, life, dlife)
+        sprite.add(*groups)
+        return sprite
+
+    def release(self, sprite):
+        self.free.append(sprite)
+
+    def in_use(self):
+        return self.capacity - len(self.free)
+
+
+class Emitter:
+    """Recipe for a burst of particles, all with the same look
+    Every emit throws out one particle per velocity from each centre point.
+    """
+    def __init__(self, velocities, width=7, height=7, colour=(100, 50, 200), alpha=255,
+                 life=80, dlife=-5, bounce=True):
+        """
+        Args:
+            velocities - (dx, dy) of each particle in a burst
+            width, height, colour, alpha - look of the particles (see get_rect_image)
+            life, dlife, bounce - as for RectSprite
+        """
+        self.velocities = np.array(velocities, dtype=float).reshape(-1, 2)
+        self.width = width
+        self.height = height
+        self.colour = tuple(colour)
+        self.alpha = alpha
+        self.life = life
+        self.dlife = dlife
+        self.bounce = bounce
+
+
+class ParticleSystem:
+    """Many short lived rectangles with no sprite, rect or group of their own
+    Positions, speeds and lives are held in flat arrays, packed so the live particles
+    are always the first count entries. Particles are drawn with one blits call per image.
+    """
+    ARRAYS = MOTION_ARRAYS + (("kind", int),)
+
+    def __init__(self, limit=PARTICLE_LIMIT, width=WIDTH, height=HEIGHT):
+        """
+        Args:
+            limit - most particles alive at once, extra ones are dropped
+            width, height - area the particles are confined to
+        """
+        self.limit = limit
+        self.width = width
+        self.height = height
+        self.count = 0
+        self.dropped = 0
+        allocate_arrays(self, self.ARRAYS, limit)
+        # Image for each kind of particle - kind is an index into this
+        self.images = []
+        self.kinds = {}
+
+    def __len__(self):
+        return self.count
+
+    def image_kind(self, width, height, colour, alpha=255):
+        """Index of the shared image for particles of this size and colour"""
+        key = (int(width), int(height), tuple(colour), alpha)
+        if key not in self.kinds:
+            self.kinds[key] = len(self.images)
+            self.images.append(get_rect_image(*key))
+        return self.kinds[key]
+
+    def add(self, xs, ys, dxs=0, dys=0, kind=0, life=80, dlife=0, bounce=True):
+        """Add a batch of particles
+        Args:
+            xs, ys - centre positions
+            dxs, dys, kind, life, dlife, bounce - single values or one per particle
+        Returns:
+            number of particles added - fewer than asked for once the limit is reached
+        """
+        start = self.count
+        wanted = len(xs)
+        added = min(wanted, self.limit - start)
+        self.dropped += wanted - added
+        end = start + added
+        for name, values in (("x", xs), ("y", ys), ("dx", dxs), ("dy", dys), ("kind", kind),
+                             ("life", life), ("dlife", dlife), ("bounce", bounce)):
+            if np.ndim(values):
+                values = values[:added]
+            getattr(self, name)[start:end] = values
+        self.prev_x[start:end] = self.x[start:end]
+        self.prev_y[start:end] = self.y[start:end]
+        self.count = end
+        return added
+
+    def emit(self, emitter, xs, ys):
+        """Throw out a burst from each of the given centre points (see Emitter)"""
+        bursts = len(xs)
+        count = len(emitter.velocities)
+        kind = self.image_kind(emitter.width, emitter.height, emitter.colour, emitter.alpha)
+        return self.add(np.repeat(xs, count), np.repeat(ys, count),
+                        np.tile(emitter.velocities[:, 0], bursts),
+                        np.tile(emitter.velocities[:, 1], bursts),
+                        kind, emitter.life, emitter.dlife, emitter.bounce)
+
+    def clear(self):
+        self.count = 0
+
+    def step(self, dt=1.0):
+        """Move, age and confine every particle then drop those whose life has run out"""
+        count = self.count
+        if not count:
+            return
+        step_motion(*(getattr(self, name)[:count] for name, _ in MOTION_ARRAYS),
+                    dt, self.width, self.height)
+        alive = self.life[:count] >= 0
+        if alive.all():
+            return
+        self.count = int(alive.sum())
+        for name, _ in self.ARRAYS:
+            array = getattr(self, name)
+            array[:self.count] = array[:count][alive]
+
+    def draw(self, surface, alpha=1.0, rects=True):
+        """Blit every particle, one batch per image
+        Args:
+            alpha - fraction of the way from the previous positions to the current ones
+            rects (bool) - return the rects drawn on, only needed for dirty updates
+        Returns:
+            list of rects drawn on (empty when rects is false)
+        """
+        count = self.count
+        drawn = []
+        if not count:
+            return drawn
+        x, y = interpolate_positions(self.x[:count], self.y[:count], self.prev_x[:count],
+                                     self.prev_y[:count], alpha, self.width, self.height)
+        kinds = self.kind[:count]
+        for kind in np.unique(kinds).tolist():
+            image = self.images[kind]
+            chosen = kinds == kind
+            lefts = np.rint(x[chosen] - image.get_width() / 2).astype(int).tolist()
+            tops = np.rint(y[chosen] - image.get_height() / 2).astype(int).tolist()
+            drawn.extend(blit_batch(surface, [(image, position) for position in zip(lefts, tops)],
+                                    rects))
+        return drawn
+
+
+# Fragments thrown out when a square or the ship is destroyed
+EXPLOSION = Emitter([(6, 6), (-6, 6), (6, -6), (-6, -6), (8, 0), (-8, 0), (0, 8), (0, -8)])
+
+
+@functools.lru_cache(maxsize=None)
+def direction_table(steps):
+    """Sine and cosine of each of steps equally spaced angles round a full turn
+    Returns:
+        (sines, cosines) - tuples of Python floats, indexed by orientation step
+    """
+    angles = np.arange(steps) * (2 * math.pi / steps)
+    # Python floats - cheaper than NumPy scalars when used one at a time
+    return tuple(np.sin(angles).tolist()), tuple(np.cos(angles).tolist())
+
+
+class RotationAtlas:
+    """Rotated copies of an image with the sine/cosine of each angle
+    Built once per source image and number of steps then shared - see shared().
+    Can be saved to disk so later runs skip the rotating.
+    """
+    # Atlases already built, by source image content and steps
+    cache = {}
+
+    def __init__(self, image, steps=ROTATION_STEPS, frames=None):
+        """
+        Args:
+            image - the unrotated image (frame 0)
+            steps - number of equally spaced angles in a full turn
+            frames - already rotated images, when loading from disk
+        """
+        self.steps = steps
+        self.key = self.image_key(image)
+        self.alpha = image.get_alpha() or 255
+        self.degrees = [360 * orientation / steps for orientation in range(steps)]
+        self.sin, self.cos = direction_table(steps)
+        if frames is None:
+            frames = [pygame.transform.rotate(image, dangle) for dangle in self.degrees]
+        self.frames = [prepare_image(frame, (0, 0, 0), self.alpha) for frame in frames]
+        # Collision masks to match each frame
+        self.masks = [pygame.mask.from_surface(frame) for frame in self.frames]
+
+    @staticmethod
+    def image_key(image):
+        """Digest identifying an image by size and content"""
+        digest = hashlib.sha1(pygame.image.tobytes(image, "RGB"))
+        digest.update(str(image.get_size()).encode())
+        return digest.hexdigest()
+
+    @classmethod
+    def shared(cls, image, steps=ROTATION_STEPS, path=None):
+        """Atlas for an image - only built the first time it's asked for
+        Args:
+            image - the unrotated image
+            steps - number of angles
+            path - optional file to load the atlas from, or save it to if it
+                   doesn't exist or was made from a different image
+        """
+        key = (cls.image_key(image), steps)
+        atlas = cls.cache.get(key)
+        if atlas is None:
+            if path and os.path.exists(path):
+                atlas = cls.load(path)
+                if (atlas.key, atlas.steps) != key:
+                    atlas = None
+            if atlas is None:
+                atlas = cls(image, steps)
+                if path:
+                    atlas.save(path)
+            cls.cache[key] = atlas
+        return atlas
+
+    def save(self, path):
+        """Write the frames to a .npz file"""
+        sizes = np.array([frame.get_size() for frame in self.frames])
+        pixels = np.frombuffer(b"".join(pygame.image.tobytes(frame, "RGB")
+                                        for frame in self.frames), dtype=np.uint8)
+        with open(path, "wb") as file:
+            np.savez_compressed(file, steps=self.steps, key=self.key, alpha=self.alpha,
+                                sizes=sizes, pixels=pixels)
+
+    @classmethod
+    def load(cls, path):
+        """Read an atlas written by save"""
+        with np.load(path, allow_pickle=False) as data:
+            sizes = data["sizes"].tolist()
+            pixels = data["pixels"].tobytes()
+            frames = []
+            offset = 0
+            for size in sizes:
+                length = size[0] * size[1] * 3
+                frames.append(pygame.image.frombytes(pixels[offset:offset + length], size, "RGB"))
+                offset += length
+            image = frames[0].copy()
+            image.set_alpha(int(data["alpha"]))
+            atlas = cls(image, int(data["steps"]), frames)
+            # Digest of the original image, in case frame 0 doesn't round trip exactly
+            atlas.key = str(data["key"])
+        return atlas
 
 
 class PlayerSprite(RectSprite):
-    def __init__(self, *args, **kwargs):
+    # Above the squares and bullets whichever rotation frame is showing - see Game.render
+    layer = 1
+
+    def __init__(self, *args, steps=ROTATION_STEPS, atlas_path=None, **kwargs):
         """
         Subclass for player sprite with extra handling for rotations, accelleration
         and bullet direction
+        Args:
+            steps - number of orientations the ship can face
+            atlas_path - optional file for caching the rotated images (see RotationAtlas.shared)
         """
         super().__init__(*args, **kwargs)
         self.orientation = 0
-        self.make_rotations()
+        # Orientation including fractions of a step, so any number of steps turns at the same rate
+        self.heading = 0.0
+        self.turn_rate = steps / 36
+        self.make_rotations(steps, atlas_path)
         self.last_orient = len(self.rotated_images)
         self.bullet_dx = 0
         self.bullet_dy = -8
 
-    def make_rotations(self, steps=36):
-        self.rotated_images = []
-        for orientation in range(steps):
-            dangle = 360 * orientation/steps
-            rangle = 2 * math.pi * orientation/steps
-            rotimage = pygame.transform.rotate(self.image, dangle)
-            self.rotated_images.append([dangle, rangle, rotimage])
+    def make_rotations(self, steps=ROTATION_STEPS, atlas_path=None):
+        self.atlas = RotationAtlas.shared(self.image, steps, atlas_path)
+        self.rotated_images = self.atlas.frames
 
     def spin(self, step):
         """Rotate the ship when orientation changed
         Also updates the sprite's rectangle to suit new angle
         Args
-            step - amount to change the orientation (by position)
+            step - amount to change the orientation (by position, scaled by turn_rate)
             positive/negative - clockwise/anticlockwise
         """
-        self.orientation = (self.orientation +  step) % self.last_orient
+        self.heading = (self.heading + step * self.turn_rate) % self.last_orient
+        self.orientation = round(self.heading) % self.last_orient
         original_centre = self.rect.center
-        self.image = self.rotated_images[self.orientation][2]
+        self.image = self.rotated_images[self.orientation]
         self.rect = self.image.get_rect()
         self.rect.center = original_centre
         #Bullet launch speed
-        rangle = self.rotated_images[self.orientation][1]
-        self.bullet_dx = -8 * math.sin(rangle)
-        self.bullet_dy = -8 * math.cos(rangle)
-
-    def accellerate(self):
-        rangle = self.rotated_images[self.orientation][1]
-        self.dx -= 1 * math.sin(rangle)
-        self.dy -= 1 * math.cos(rangle)
+        self.bullet_dx = -8 * self.atlas.sin[self.orientation]
+        self.bullet_dy = -8 * self.atlas.cos[self.orientation]
+
+    def accellerate(self, dt=1.0):
+        """Thrust for dt base ticks"""
+        self.dx -= dt * self.atlas.sin[self.orientation]
+        self.dy -= dt * self.atlas.cos[self.orientation]
         # Friction at high speeds - stop going too fast
         if self.dx * self.dx > 100:
-            self.dx *= 0.9
+            self.dx *= 0.9 ** dt
         if self.dy * self.dy > 100:
-            self.dy *= 0.9
+            self.dy *= 0.9 ** dt
+
+@functools.lru_cache(maxsize=32)
+def get_font(name=None, size=36, bold=False, italic=False):
+    """Shared pygame font - only the first request for each combination searches for and loads it
+    Least recently used fonts are dropped once more than 32 are held.
+    Args are as for pygame.font.SysFont
+    """
+    return pygame.font.SysFont(name, size, bold, italic)
+
+
+def preload_fonts(*specs):
+    """Load fonts ahead of time, e.g. at startup
+    Args:
+        specs - tuples of get_font arguments, e.g. (None, 36), ("arial", 24, True)
+    """
+    for spec in specs:
+        get_font(*spec)
+
 
 class TextSprite(pygame.sprite.Sprite):
     """Used to display text"""
+    # Drawn after (on top of) everything else - see Game.render
+    layer = 2
+
     def __init__(self, x=0, y=0, text="", font=None, size=36, colour=(255, 255, 255)):
         super().__init__()
-        font = pygame.font.SysFont(font, size)
-        self.image = font.render(text, True, colour)
+        font = get_font(font, size)
+        self.image = prepare_image(font.render(text, True, colour))
         self.rect = self.image.get_rect()
         self.rect.x = x
         self.rect.y = y
 
 
+def sprite_order(sprite):
+    """Sort key for drawing - layer (default 0), then image within a layer"""
+    return getattr(sprite, "layer", 0), id(sprite.image)
+
+
+class GlyphAtlas:
+    """Characters pre-rendered once so changing text can be assembled by blitting
+    rather than rasterising it with the font every time
+    """
+    def __init__(self, font, colour=(255, 255, 255), characters="0123456789-"):
+        self.font = font
+        self.colour = colour
+        self.glyphs = {char: prepare_image(font.render(char, True, colour)) for char in characters}
+        self.height = font.get_height()
+
+    def compose(self, text):
+        """Surface showing the text - characters missing from the atlas are rendered as needed"""
+        glyphs = [self.glyphs.get(char) or self.font.render(char, True, self.colour)
+                  for char in text]
+        image = pygame.Surface((sum(glyph.get_width() for glyph in glyphs), self.height),
+                               pygame.SRCALPHA)
+        x = 0
+        for glyph in glyphs:
+            image.blit(glyph, (x, 0))
+            x += glyph.get_width()
+        return prepare_image(image)
+
+
+class HudText:
+    """A labelled value on the HUD, e.g. "SCORE: 10"
+    The image is only rebuilt when the value changes.
+    """
+    def __init__(self, label, position, font, colour=(0, 255, 0), atlas=None):
+        """
+        Args:
+            label - fixed text shown before the value
+            position - (x, y) of top left
+            font - pygame Font to render with
+            colour - text colour
+            atlas - optional GlyphAtlas used to assemble the value's digits
+        """
+        self.position = position
+        self.font = font
+        self.colour = colour
+        self.atlas = atlas
+        self.label = label
+        self.label_image = prepare_image(font.render(label, True, colour))
+        self.value = None
+        self.image = self.label_image
+
+    def draw(self, screen, value):
+        """Blit the text showing the given value
+        Returns:
+            the rect drawn on
+        """
+        if value != self.value:
+            self.value = value
+            if self.atlas:
+                value_image = self.atlas.compose(str(value))
+                width = self.label_image.get_width() + value_image.get_width()
+                height = max(self.label_image.get_height(), value_image.get_height())
+                image = pygame.Surface((width, height), pygame.SRCALPHA)
+                image.blit(self.label_image, (0, 0))
+                image.blit(value_image, (self.label_image.get_width(), 0))
+                self.image = prepare_image(image)
+            else:
+                self.image = prepare_image(self.font.render(f"{self.label}{value}", True,
+                                                            self.colour))
+        return screen.blit(self.image, self.position)
+
+
+class Profiler:
+    """Times the phases of each frame and keeps the last few hundred frames of samples
+    Call start_frame, then mark(phase) at the end of each phase, then end_frame.
+    Phases marked more than once in a frame (e.g. one per tick) are added together.
+    """
+    def __init__(self, history=300):
+        self.history = history
+        self.samples = {}
+        self.frame_times = deque(maxlen=history)
+        self.current = {}
+        self.frame_start = self.last = time.perf_counter()
+
+    def start_frame(self):
+        self.current = {}
+        self.frame_start = self.last = time.perf_counter()
+
+    def mark(self, phase):
+        """Record the time since the previous mark as belonging to phase"""
+        now = time.perf_counter()
+        self.current[phase] = self.current.get(phase, 0.0) + now - self.last
+        self.last = now
+
+    def end_frame(self):
+        for phase, duration in self.current.items():
+            if phase not in self.samples:
+                # Zeros for frames before this phase first appeared, so rows line up
+                self.samples[phase] = deque([0.0] * len(self.frame_times), maxlen=self.history)
+            self.samples[phase].append(duration)
+        for phase, samples in self.samples.items():
+            if phase not in self.current:
+                samples.append(0.0)
+        self.frame_times.append(self.last - self.frame_start)
+
+    def summary(self):
+        """Mean and worst time of each phase over the history, in milliseconds
+        Returns:
+            dict of phase: (mean, maximum)
+        """
+        return {phase: (1000 * sum(samples) / len(samples), 1000 * max(samples))
+                for phase, samples in self.samples.items() if samples}
+
+    def histogram(self, phase, bins=10):
+        """Counts of the phase's times (ms) falling in each of bins equal ranges
+        Returns:
+            (counts, bin edges) as from numpy.histogram
+        """
+        return np.histogram(np.array(self.samples[phase]) * 1000, bins=bins)
+
+    def dump(self, path):
+        """Write the samples as CSV - one row per frame, times in milliseconds"""
+        phases = list(self.samples)
+        with open(path, "w") as file:
+            file.write(",".join(["frame"] + phases) + "\n")
+            for row in zip(self.frame_times, *(self.samples[phase] for phase in phases)):
+                file.write(",".join(f"{1000 * value:.4f}" for value in row) + "\n")
+
+
+class SpatialHash:
+    """Uniform grid of cells for finding sprites that might overlap
+    Each sprite is filed under every cell its rect touches, so a query only
+    has to look at sprites sharing a cell rather than every sprite.
+    Default cell size matches the XCHUNKS/YCHUNKS spacing.
+    """
+    def __init__(self, cell_width=int(XSCALE), cell_height=int(YSCALE)):
+        self.cell_width = cell_width
+        self.cell_height = cell_height
+        self.cells = {}
+
+    def clear(self):
+        self.cells.clear()
+
+    def cell_keys(self, rect):
+        """(column, row) keys of all cells covered by a rect"""
+        columns = range(rect.left // self.cell_width, (rect.right - 1) // self.cell_width + 1)
+        rows = range(rect.top // self.cell_height, (rect.bottom - 1) // self.cell_height + 1)
+        return [(column, row) for column in columns for row in rows]
+
+    def insert(self, sprite):
+        for key in self.cell_keys(sprite.rect):
+            self.cells.setdefault(key, []).append(sprite)
+
+    def rebuild(self, sprites):
+        """Replace contents with the given sprites - call once per tick after they've moved"""
+        self.clear()
+        for sprite in sprites:
+            self.insert(sprite)
+
+    def query(self, rect):
+        """Sprites whose rects overlap the given rect
+        Returns:
+            list of sprites, each appearing once, in the order they were inserted
+        """
+        found = {}
+        for key in self.cell_keys(rect):
+            for sprite in self.cells.get(key, ()):
+                if sprite not in found and rect.colliderect(sprite.rect):
+                    found[sprite] = True
+        return list(found)
+
+
 class Game:
-    def __init__(self):
-        self.screen = pygame.display.set_mode((WIDTH, HEIGHT))
-        pygame.display.set_caption("Things Happening")
+    def __init__(self, headless=False, fps=60, dirty=False, tick_rate=TICK_RATE, seed=None,
+                 record=False, screen=None, rotation_steps=ROTATION_STEPS, atlas_path=None,
+                 bullet_pool_size=BULLET_POOL_SIZE):
+        """
+        Args:
+            headless (bool) - when true no window is opened. The game is driven by
+                run(), or by calling tick()/step() and render(). A headless game
+                without a screen can only be stepped - run() and render() need somewhere to draw
+            fps (int) - maximum rendered frames per second, 0 for no limit.
+                The simulation always runs at tick_rate regardless
+            dirty (bool) - when true only the parts of the screen that have
+                changed are cleared and sent to the display each frame
+            tick_rate (int) - simulation ticks per second. Fewer, longer ticks
+                give approximately the same motion for less work
+            seed (int) - seed for all the game's random numbers, random if None.
+                The same seed and inputs always give the same game
+            record (bool) - when true keep the inputs of every tick in
+                self.recording so the game can be replayed
+            screen - surface for a headless game to draw on when render is
+                called, e.g. an off-screen surface or an already open window
+            rotation_steps (int) - number of orientations the ship can face
+            atlas_path - optional file caching the ship's rotated images (see RotationAtlas.shared)
+            bullet_pool_size (int) - most bullets alive at once, shots beyond this are dropped
+        """
+        self.headless = headless
+        self.seed = int.from_bytes(os.urandom(8), "little") if seed is None else seed
+        self.rng = np.random.default_rng(self.seed)
+        self.recording = InputRecording(self.seed, tick_rate, rotation_steps) if record else None
+        self.fps = fps
+        self.tick_time = 1 / tick_rate
+        # Length of a tick in base ticks
+        self.dt = BASE_TICK_RATE / tick_rate
+        self.dirty = dirty
+        # Areas drawn on in the previous frame - need clearing in dirty mode
+        self.drawn_rects = []
+        # (image, rect) pairs for the sprites in a frame - kept to save building a new list each time
+        self.blit_list = []
+        # Per-phase frame timings, shown on screen when show_profile is set
+        self.profiler = Profiler()
+        self.show_profile = False
+        self.profile_lines = []
+        self.profile_refreshed = 0.0
+        if headless:
+            self.screen = screen
+        else:
+            self.screen = pygame.display.set_mode((WIDTH, HEIGHT))
+            pygame.display.set_caption("Things Happening")
         self.clock = pygame.time.Clock()
+        self.font = get_font(None, 36)
+        # Score and level display
+        hud_glyphs = GlyphAtlas(self.font, (0, 255, 0))
+        self.score_text = HudText("SCORE: ", (XCHUNKS[1], YCHUNKS[0]), self.font, atlas=hud_glyphs)
+        self.level_text = HudText("LEVEL: ", (XCHUNKS[-4], YCHUNKS[0]), self.font, atlas=hud_glyphs)
         self.all_sprites = pygame.sprite.Group()
         self.square_sprites = pygame.sprite.Group()
         self.player_bullet_sprites = pygame.sprite.Group()
+        # Physics state of every RectSprite and Entity in the game
+        self.entities = EntityStore()
+        self.bullet_pool = SpritePool(bullet_pool_size, functools.partial(
+            Entity, width=2, height=2, store=self.entities))
+        # Explosion fragments and other decoration - not sprites at all
+        self.particles = ParticleSystem()
+        # Broadphase lookup for squares - rebuilt every tick
+        self.square_grid = SpatialHash()
         self.keep_going = True
+        # Ship collisions are still tested but never end the game - for benchmarking
+        self.invulnerable = False
         self.game_in_progress = False
         self.level = 0 # Could replace game_in_progress with level > 0
         self.score = 0
+        self.ticks = 0
 
         # Player ship setup
         player_ship_image = pygame.Surface([20, 32])
         pygame.draw.polygon(player_ship_image, (255, 255, 0), [(0,32), (10, 0), (20, 32), (10, 24)], width=0)
-        self.player = PlayerSprite(MIDWIDTH, MIDHEIGHT, 0, 0, image=player_ship_image)
+        self.player = PlayerSprite(MIDWIDTH, MIDHEIGHT, 0, 0, image=player_ship_image,
+                                   store=self.entities, steps=rotation_steps,
+                                   atlas_path=atlas_path)
         # Used to control player fire rate
         self.reload_counter = 0
 
-        self.game_loop()
+        self.welcome_screen()
 
 
     def welcome_screen(self):
         # Decorative jumping up and down squares
+        # Particles that never die - one batch per row for each colour
+        width, height = int(XSCALE), int(YSCALE)
+        xs = np.array(XCHUNKS, dtype=float) + width / 2
         for yi, y in enumerate(YCHUNKS[-9:]): # Last 7 ychunks
-            for xi, x in enumerate(XCHUNKS):
-                if xi%2 == 0:
-                    sprite = RectSprite(x=x, y=y, dy=-4, width=int(XSCALE), height=int(YSCALE), colour=(yi*20, 0, 255-(yi*20)), alpha=180)
-                    self.all_sprites.add(sprite)
-                else:
-                    sprite = RectSprite(x=x, y=y, dy=-2, width=int(XSCALE), height=int(YSCALE), colour=(yi*22, 255-(yi*20),0), alpha=180)
-                    self.all_sprites.add(sprite)
+            ys = np.full(len(xs), y + height / 2)
+            blue = self.particles.image_kind(width, height, (yi*20, 0, 255-(yi*20)), 180)
+            green = self.particles.image_kind(width, height, (yi*22, 255-(yi*20),0), 180)
+            self.particles.add(xs[0::2], ys[0::2], dys=-4, kind=blue, dlife=0)
+            self.particles.add(xs[1::2], ys[1::2], dys=-2, kind=green, dlife=0)
 
         # Information Text
         text = ["SQASTEROIDS!!!",
@@ -203,113 +1061,390 @@ class Game:
         self.score = 0
         self.level = 1
         # Empty the sprite groups - clear any leftovers from previous game
-        self.all_sprites.empty()
+        # Killed rather than just removed so they leave the entity store too
+        for sprite in self.all_sprites.sprites():
+            sprite.kill()
         self.square_sprites.empty()
         self.player_bullet_sprites.empty()
+        self.particles.clear()
         self.level_setup()
+        # Ship back to the middle, stationary
+        self.player.kill()
+        self.player.reset(MIDWIDTH, MIDHEIGHT, 0, 0)
         self.all_sprites.add(self.player)
 
+    def game_over(self):
+        """Ship destroyed - score and level stay on screen until the next game"""
+        self.game_in_progress = False
+        # Out of sight but still in the entity store, so still safe to read
+        self.all_sprites.remove(self.player)
+        self.player.dx = self.player.dy = 0
+        # Shots still in flight mustn't score once the game has ended
+        for bullet in self.player_bullet_sprites.sprites():
+            bullet.kill()
+        sprite = TextSprite(text="GAME OVER - Press SPACE to start", y=YCHUNKS[12])
+        sprite.rect.centerx = MIDWIDTH
+        self.all_sprites.add(sprite)
+
     def level_setup(self):
         # Squasteroids
-        for _ in range(3 + self.level):
-            # Set starting positions
-            x = MIDWIDTH
-            y = MIDHEIGHT
+        count = 3 + self.level
+        xs = np.empty(0)
+        ys = np.empty(0)
+        # Set starting positions in batches until there are enough
+        while len(xs) < count:
+            x = self.rng.integers(0, WIDTH, count, endpoint=True)
+            y = self.rng.integers(0, HEIGHT, count, endpoint=True)
             # keep middle of screen clear as a safe zone for ship at level start
-            while (XCHUNKS[10] < x < XCHUNKS[-10] and YCHUNKS[10] < y < YCHUNKS[-10]):
-                x = random.randint(0, WIDTH)
-                y = random.randint(0, HEIGHT)
-            self.make_sqasteroid(x, y, life=3)
+            clear = ~((XCHUNKS[10] < x) & (x < XCHUNKS[-10]) & (YCHUNKS[10] < y) & (y < YCHUNKS[-10]))
+            xs = np.concatenate((xs, x[clear]))
+            ys = np.concatenate((ys, y[clear]))
+        self.make_sqasteroids(xs[:count].tolist(), ys[:count].tolist(), life=3)
 
     def make_sqasteroid(self, x, y, life=3):
-        angle = random.uniform(0, math.pi*2)
-        dx = 4 * math.sin(angle)
-        dy = 4 * math.cos(angle)
-        new_square = RectSprite(x, y, dx, dy, width=int(XSCALE*life), height=(YSCALE*life), colour=(100, 50, 200), alpha=128, life=life, dlife=0)
-        self.all_sprites.add(new_square)
-        self.square_sprites.add(new_square)
+        self.make_sqasteroids([x], [y], life)
+
+    def make_sqasteroids(self, xs, ys, life=3):
+        """Make a batch of squares of the same size, each heading in a random direction
+        Args:
+            xs, ys - top left coordinates, one pair per square
+            life - size of the squares (1-3)
+        """
+        angles = self.rng.uniform(0, math.pi*2, len(xs))
+        dxs = (4 * np.sin(angles)).tolist()
+        dys = (4 * np.cos(angles)).tolist()
+        new_squares = [Entity(x, y, dx, dy, width=int(XSCALE*life), height=(YSCALE*life), colour=(100, 50, 200), alpha=128, life=life, dlife=0, store=self.entities)
+                       for x, y, dx, dy in zip(xs, ys, dxs, dys)]
+        Entity.add_new(new_squares, self.all_sprites, self.square_sprites)
 
     def shoot(self):
         """Shoot bullet"""
         if self.reload_counter < 1:
             self.reload_counter = 15
-            shot = RectSprite(self.player.rect.centerx, self.player.rect.centery,
-                              self.player.bullet_dx+self.player.dx,
-                              self.player.bullet_dy+self.player.dy,
-                              width=2, height=2, life=80, dlife=-1)
-            self.all_sprites.add(shot)
-            self.player_bullet_sprites.add(shot)
+            self.bullet_pool.acquire(self.player.x, self.player.y,
+                                     self.player.bullet_dx+self.player.dx,
+                                     self.player.bullet_dy+self.player.dy,
+                                     life=80, dlife=-1,
+                                     groups=(self.all_sprites, self.player_bullet_sprites))
+
+    def collisions(self):
+        """Find the squares hit by bullets or by the ship"""
+        if not self.game_in_progress:
+            return
+        self.entities.sync_rects(sprites=self.square_sprites)
+        self.square_grid.rebuild(self.square_sprites)
+        self.bullet_collisions()
+        if self.game_in_progress:
+            self.ship_collisions()
+
+    def ship_collisions(self):
+        """End the game if the ship touches a square
+        Squares overlapping the ship's rect are found with square_grid (which must
+        be up to date) then checked pixel by pixel with masks made in advance
+        """
+        player = self.player
+        self.entities.sync_rects(sprites=[player])
+        player_mask = player.atlas.masks[player.orientation]
+        for square in self.square_grid.query(player.rect):
+            if not square.alive():
+                continue
+            offset = (square.rect.x - player.rect.x, square.rect.y - player.rect.y)
+            if player_mask.overlap(get_rect_mask(square.rect.width, square.rect.height), offset):
+                if self.invulnerable:
+                    return
+                self.explode([player.x], [player.y])
+                self.game_over()
+                return
 
     def bullet_collisions(self):
         # Bullet/square collision - removes any that have collided from the groups
         # Note this does not delete the sprites themselves - just ends their membership of *any* groups
-        collided = pygame.sprite.groupcollide(self.square_sprites, self.player_bullet_sprites, True, True)
-        for target in collided.keys():
-            # Increase score, with bigger score from smaller target
-            self.score += (4-target.life)
-            #Make 2 smaller asteroids if destroyed asteroid is above minimum size
-            if target.life > 1:
-                life = target.life -1
-                self.make_sqasteroid(target.rect.x, target.rect.y, life=life)
-                self.make_sqasteroid(target.rect.x, target.rect.y, life=life)
-            # Add explosion here
-            for dx, dy in [(6, 6), (-6, 6), (6, -6), (-6, -6), (8, 0), (-8, 0), (0, 8), (0, -8)]:
-                self.all_sprites.add(RectSprite(target.rect.centerx,
-                                                target.rect.centery,
-                                                dx, dy, width=7, height=7,
-                                                colour=(100, 50, 200), dlife=-5))
+        # Each bullet destroys at most one square
+        # square_grid must already be up to date
+        if not self.player_bullet_sprites:
+            return
+        self.entities.sync_rects(sprites=self.player_bullet_sprites)
+        collided = []
+        for bullet in self.player_bullet_sprites.sprites():
+            for target in self.square_grid.query(bullet.rect):
+                if target.alive():
+                    target.kill()
+                    bullet.kill()
+                    collided.append(target)
+                    break
+        if not collided:
+            return
+        # Everything destroyed this tick is replaced in one batch per square size
+        lives = [int(target.life) for target in collided]
+        xs = [target.rect.x for target in collided]
+        ys = [target.rect.y for target in collided]
+        # Increase score, with bigger score from smaller target
+        self.score += sum(4 - life for life in lives)
+        #Make 2 smaller asteroids if destroyed asteroid is above minimum size
+        for life in set(lives) - {1}:
+            split = [index for index, target_life in enumerate(lives) if target_life == life] * 2
+            self.make_sqasteroids([xs[index] for index in split], [ys[index] for index in split],
+                                  life=life - 1)
+        self.explode([target.x for target in collided], [target.y for target in collided])
+
+    def explode(self, xs, ys):
+        """Throw out explosion fragments from each of the given centre points"""
+        self.particles.emit(EXPLOSION, xs, ys)
+
+    def step(self, inputs=0):
+        """Advance the game by one tick
+        Args:
+            inputs - player controls for this tick, OR of ROTATE_LEFT, ROTATE_RIGHT,
+                     THRUST, FIRE and START
+        Returns:
+            the game state after the tick (see get_state)
+        """
+        self.tick(inputs)
+        return self.get_state()
+
+    def tick(self, inputs=0):
+        """Advance the game by one tick, as step but without building the state"""
+        profiler = self.profiler
+        if self.recording is not None:
+            self.recording.record(inputs)
+        self.apply_inputs(inputs)
+        self.reload_counter -= self.dt
+        profiler.mark("inputs")
+        self.collisions()
+        profiler.mark("collisions")
+        for sprite in self.entities.step(self.dt):
+            sprite.kill()
+        self.particles.step(self.dt)
+        profiler.mark("physics")
+
+        # New Level when all enemies destroyed
+        if self.game_in_progress and len(self.square_sprites) < 1:
+            self.level += 1
+            self.level_setup()
+        self.ticks += 1
+        profiler.mark("level")
+
+    def get_state(self):
+        """Snapshot of the game as plain Python values"""
+        player = self.player
+        return {"ticks": self.ticks,
+                "score": self.score,
+                "level": self.level,
+                "game_in_progress": self.game_in_progress,
+                "player": (player.x, player.y, player.dx, player.dy, player.orientation),
+                "squares": [(sprite.x, sprite.y,
+                             sprite.dx, sprite.dy, sprite.life)
+                            for sprite in self.square_sprites],
+                "bullets": len(self.player_bullet_sprites)}
 
     def game_loop(self):
-        font = pygame.font.SysFont(None, 36)
-        self.welcome_screen()
+        # Simulation time still to be run - topped up by each frame's duration
+        accumulator = 0.0
+        profiler = self.profiler
         while self.keep_going:
-            self.check_events()
-            self.screen.fill((0, 0, 0))
-
-            self.reload_counter -= 1
-            self.all_sprites.draw(self.screen)
-            self.bullet_collisions()
-            self.all_sprites.update()
-
-            # When game in progress
-            if self.level > 0:
-                # Display
-                score_image = font.render(f"SCORE: {self.score}", True, (0, 255, 0))
-                level_image = font.render(f"LEVEL: {self.level}", True, (0, 255, 0))
-                self.screen.blit(score_image, (XCHUNKS[1], YCHUNKS[0]))
-                self.screen.blit(level_image, (XCHUNKS[-4], YCHUNKS[0]))
-
-                # New Level when all enemies destroyed
-                if len(self.square_sprites) < 1:
-                    self.level += 1
-                    self.level_setup()
-
-            pygame.display.update()
-            self.clock.tick(60)
-        pygame.quit()
+            profiler.start_frame()
+            accumulator += self.clock.tick(self.fps) / 1000
+            profiler.mark("wait")
+            inputs = self.check_events()
+            profiler.mark("events")
+            ticks = 0
+            while accumulator >= self.tick_time and ticks < MAX_TICKS_PER_FRAME:
+                self.tick(inputs)
+                accumulator -= self.tick_time
+                ticks += 1
+            # Fell too far behind - drop the backlog rather than trying to catch up
+            accumulator = min(accumulator, self.tick_time)
+            self.render(accumulator / self.tick_time)
+            profiler.end_frame()
+
+    def run(self):
+        """Play until the window is closed, then shut down"""
+        self.check_screen()
+        self.game_loop()
+        self.shutdown()
+
+    def shutdown(self):
+        """Remove every sprite and stop the game
+        pygame itself is left running so other games can be created in the same process
+        """
+        self.keep_going = False
+        for sprite in self.all_sprites.sprites():
+            sprite.kill()
+        self.player.kill()
+        for group in (self.all_sprites, self.square_sprites, self.player_bullet_sprites):
+            group.empty()
+        self.entities.clear()
+        self.particles.clear()
+        self.square_grid.clear()
+
+    def check_screen(self):
+        """Raise ValueError if there's nowhere to draw"""
+        if self.screen is None:
+            raise ValueError("Headless game has no screen to draw on - pass screen= to Game")
+
+    def render(self, alpha=1.0):
+        """Draw the current frame
+        Args:
+            alpha - fraction of a tick elapsed since the last step. Moving sprites
+                    are drawn this far between their previous and current positions
+        """
+        self.check_screen()
+        screen = self.screen
+        profiler = self.profiler
+        if self.dirty:
+            for rect in self.drawn_rects:
+                screen.fill((0, 0, 0), rect)
+        else:
+            screen.fill((0, 0, 0))
+        profiler.mark("clear")
+        drawn = self.particles.draw(screen, alpha, self.dirty)
+        self.entities.sync_rects(alpha)
+        drawn.extend(self.draw_sprites())
+        profiler.mark("draw")
+
+        # When game in progress
+        if self.level > 0:
+            # Display
+            drawn.append(self.score_text.draw(screen, self.score))
+            drawn.append(self.level_text.draw(screen, self.level))
+        if self.show_profile:
+            drawn.extend(self.draw_profile())
+        profiler.mark("hud")
+
+        # Off-screen surfaces don't need sending to the display
+        if screen is pygame.display.get_surface():
+            if self.dirty:
+                # Old positions need updating too, to show them cleared
+                pygame.display.update(self.drawn_rects + drawn)
+            else:
+                pygame.display.update()
+        self.drawn_rects = drawn
+        profiler.mark("flip")
+
+    def draw_sprites(self):
+        """Blit all_sprites in one batch, sorted by layer then image so sprites
+        sharing an image are drawn one after another
+        Returns:
+            rects drawn on - only collected in dirty mode
+        """
+        batch = self.blit_list
+        batch.clear()
+        batch.extend((sprite.image, sprite.rect) for sprite in
+                     sorted(self.all_sprites, key=sprite_order))
+        return blit_batch(self.screen, batch, self.dirty)
+
+    def draw_profile(self):
+        """Show frame rate, phase timings and sprite counts in the bottom left
+        The text is refreshed a few times a second so it stays readable
+        Returns:
+            rects drawn on
+        """
+        now = time.perf_counter()
+        if now - self.profile_refreshed > 0.25:
+            self.profile_refreshed = now
+            font = get_font(None, 22)
+            lines = [f"FPS: {self.clock.get_fps():.1f}"]
+            lines += [f"{phase}: {mean:.2f} ms (max {worst:.2f})"
+                      for phase, (mean, worst) in self.profiler.summary().items()]
+            lines.append(f"sprites: {len(self.all_sprites)}  squares: {len(self.square_sprites)}  "
+                         f"bullets: {len(self.player_bullet_sprites)}")
+            lines.append(f"bullets in use: {self.bullet_pool.in_use()}  "
+                         f"particles: {len(self.particles)} (dropped {self.particles.dropped})")
+            self.profile_lines = [prepare_image(font.render(line, True, (255, 128, 0)))
+                                  for line in lines]
+        y = HEIGHT - 20 * len(self.profile_lines)
+        drawn = []
+        for image in self.profile_lines:
+            drawn.append(self.screen.blit(image, (XCHUNKS[1], y)))
+            y += 20
+        return drawn
 
     def check_events(self):
+        """Handle window events and read the player controls
+        Returns:
+            the controls currently held down as a bitmask
+        """
         for event in pygame.event.get():
             if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN
                                              and event.key == pygame.K_ESCAPE):
                 self.keep_going = False
-        # Player Controls
+            # Performance overlay on/off
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                self.show_profile = not self.show_profile
+            # Save timings
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F4:
+                self.profiler.dump(time.strftime("sqasteroids-profile-%Y%m%d-%H%M%S.csv"))
         keys = pygame.key.get_pressed()
+        inputs = 0
+        for key, control in CONTROL_KEYS:
+            if keys[key]:
+                inputs |= control
+        return inputs
+
+    def apply_inputs(self, inputs):
+        """Player Controls"""
+        if not self.game_in_progress:
+            if inputs & START:
+                self.start_game()
+            return
         # Rotate clockwise
-        if keys[pygame.K_a]:
-            self.player.spin(1)
+        if inputs & ROTATE_LEFT:
+            self.player.spin(self.dt)
         # Rotate anticlockwise
-        if keys[pygame.K_d]:
-            self.player.spin(-1)
+        if inputs & ROTATE_RIGHT:
+            self.player.spin(-self.dt)
         # Accellerate
-        if keys[pygame.K_RSHIFT]:
-            self.player.accellerate()
+        if inputs & THRUST:
+            self.player.accellerate(self.dt)
         # Shoot
-        if keys[pygame.K_RETURN]:
+        if inputs & FIRE:
             self.shoot()
 
-        if not self.game_in_progress and keys[pygame.K_SPACE]:
-            self.start_game()
+
+class InputRecording:
+    """Everything needed to replay a game - its seed, tick rate, rotation steps and the inputs of every tick
+    Saved in a compact binary form - a short header then one byte per tick.
+    """
+    MAGIC = b"SQAR"
+    VERSION = 2
+    # Magic, version, tick rate, seed, rotation steps
+    HEADER = struct.Struct("<4sBHQH")
+
+    def __init__(self, seed, tick_rate=TICK_RATE, rotation_steps=ROTATION_STEPS, inputs=b""):
+        self.seed = seed
+        self.tick_rate = tick_rate
+        self.rotation_steps = rotation_steps
+        self.inputs = bytearray(inputs)
+
+    def record(self, inputs):
+        self.inputs.append(inputs)
+
+    def save(self, path):
+        with open(path, "wb") as file:
+            file.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.tick_rate, self.seed,
+                                        self.rotation_steps))
+            file.write(self.inputs)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as file:
+            data = file.read()
+        magic, version, tick_rate, seed, rotation_steps = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError(f"{path} is not a version {cls.VERSION} input recording")
+        return cls(seed, tick_rate, rotation_steps, data[cls.HEADER.size:])
+
+    def replay(self):
+        """Re-run the recorded game headless, as fast as possible
+        Returns:
+            the replayed Game, left at the end of the recording
+        """
+        game = Game(headless=True, tick_rate=self.tick_rate, seed=self.seed,
+                    rotation_steps=self.rotation_steps)
+        step = game.step
+        for inputs in self.inputs:
+            step(inputs)
+        return game
 
 
 def confiner(current, delta, minimum, maximum, bounce=True):
@@ -338,5 +1473,98 @@ def confiner(current, delta, minimum, maximum, bounce=True):
     return current, delta
 
 
+def confine_arrays(current, delta, minimum, maximum, bounce=True):
+    """Array version of confiner - confines every element in place
+    Args:
+        current - NumPy array of current values, updated in place
+        delta - NumPy array of value increments, updated in place
+        minimum - the minimum allowed value
+        maximum - the maximum allowed value
+        bounce - bool, or boolean array choosing per element, when true cause value to
+                 "rebound" otherwise wrap beteen min and max
+    """
+    below = current < minimum
+    above = current > maximum
+    outside = below | above
+    # Usually nothing is out of range, so skip the rest
+    if not outside.any():
+        return
+    bouncing = outside & bounce
+    wrapping = outside & ~np.asarray(bounce, dtype=bool)
+    # Bounce - reset to the limit that was crossed and invert delta
+    current[below & bouncing] = minimum
+    current[above & bouncing] = maximum
+    np.negative(delta, out=delta, where=bouncing)
+    # Wrap - move to the opposite limit, delta unchanged
+    current[below & wrapping] = maximum
+    current[above & wrapping] = minimum
+
+
+
+def allocate_arrays(target, arrays, capacity, keep=0):
+    """Give target a zeroed NumPy array attribute for each (name, dtype) in arrays
+    Args:
+        capacity - length of the arrays
+        keep - number of entries to copy over from target's existing arrays, when growing them
+    """
+    for name, dtype in arrays:
+        array = np.zeros(capacity, dtype=dtype)
+        if keep:
+            array[:keep] = getattr(target, name)[:keep]
+        setattr(target, name, array)
+
+
+def step_motion(x, y, prev_x, prev_y, dx, dy, life, dlife, bounce, dt, width, height):
+    """Move, age and confine a batch of entities - all the arrays are updated in place
+    Args:
+        x, y - centre positions. prev_x, prev_y get the positions from before the move
+        dt - length of the tick in base ticks (see BASE_TICK_RATE)
+        width, height - area to keep within, bouncing or wrapping as bounce says
+    """
+    prev_x[:] = x
+    prev_y[:] = y
+    x += dx * dt
+    y += dy * dt
+    life += dlife * dt
+    confine_arrays(x, dx, 0, width, bounce)
+    confine_arrays(y, dy, 0, height, bounce)
+
+
+def interpolate_positions(x, y, prev_x, prev_y, alpha, width, height):
+    """Positions alpha of the way from prev_x, prev_y to x, y
+    Returns:
+        (x, y) arrays - new ones unless alpha is 1
+    """
+    if alpha >= 1:
+        return x, y
+    # Big jumps are wrap-rounds, not movement, so don't draw a streak across the screen
+    moved = (np.abs(x - prev_x) < width / 2) & (np.abs(y - prev_y) < height / 2)
+    return (np.where(moved, prev_x + (x - prev_x) * alpha, x),
+            np.where(moved, prev_y + (y - prev_y) * alpha, y))
+
+
 if __name__ == "__main__":
-    go = Game()
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seed", type=int, help="seed for a repeatable game")
+    parser.add_argument("--record", metavar="FILE", help="save the game's inputs to FILE")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="re-run a recorded game without a window and show the final state")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="save per-phase timings of the last frames to FILE (CSV)")
+    parser.add_argument("--rotation-steps", type=int, default=ROTATION_STEPS,
+                        help="number of orientations the ship can face")
+    parser.add_argument("--atlas", metavar="FILE",
+                        help="cache the ship's rotated images in FILE (.npz) between runs")
+    args = parser.parse_args()
+    if args.replay:
+        print(InputRecording.load(args.replay).replay().get_state())
+    else:
+        go = Game(seed=args.seed, record=bool(args.record),
+                  rotation_steps=args.rotation_steps, atlas_path=args.atlas)
+        go.run()
+        if args.record:
+            go.recording.save(args.record)
+        if args.profile:
+            go.profiler.dump(args.profile)
+    pygame.quit()